@@ -72,3 +72,17 @@ def set_seed(seed: int = 0):
     torch.backends.cudnn.deterministic = True
     torch.backends.cudnn.benchmark = False
     np.random.seed(seed)
+
+
+def enable_fast_math():
+    """Enables faster but non-deterministic GPU math.
+
+    Turns on cuDNN autotuning over all (including non-deterministic) algorithms and lets float32
+    matmuls and convolutions use TF32 on Ampere or newer GPUs. This overrides the deterministic
+    settings of ``set_seed``.
+    """
+    torch.backends.cudnn.deterministic = False
+    torch.backends.cudnn.benchmark = True
+    torch.backends.cudnn.allow_tf32 = True
+    if hasattr(torch, "set_float32_matmul_precision"):
+        torch.set_float32_matmul_precision("high")
@@ -156,8 +156,7 @@ class ClassifierTrainer(Trainer):
                     self.sampling_model.classify(x), labels_train.view(-1)
                 )
             else:
-                if self.sampling_model.log_variational:
-                    x = torch.log(1 + x)
+                x = self.sampling_model.encoder_input(x)
                 if self.sampling_zl:
                     x_z = self.sampling_model.z_encoder(x)[0]
                     x_l = self.sampling_model.l_encoder(x)[0]
@@ -318,8 +317,7 @@ def compute_predictions(
         elif classifier is not None:
             # Then we use the specified classifier
             if model is not None:
-                if model.log_variational:
-                    sample_batch = torch.log(1 + sample_batch)
+                sample_batch = model.encoder_input(sample_batch)
                 if model_zl:
                     sample_z = model.z_encoder(sample_batch)[0]
                     sample_l = model.l_encoder(sample_batch)[0]
@@ -1,5 +1,6 @@
 import logging
 import copy
+from itertools import chain
 from typing import Union
 
 import matplotlib.pyplot as plt
@@ -170,11 +171,20 @@ class AdapterTrainer(UnsupervisedTrainer):
         super().__init__(model, gene_dataset, frequency=frequency)
         self.test_set = posterior_test
         self.test_set.to_monitor = ["elbo"]
-        self.params = list(self.model.z_encoder.parameters()) + list(
-            self.model.l_encoder.parameters()
-        )
-        self.z_encoder_state = copy.deepcopy(model.z_encoder.state_dict())
-        self.l_encoder_state = copy.deepcopy(model.l_encoder.state_dict())
+        # the shared input layer, if any, is the only one that sees the data
+        self.adapted_modules = [
+            module
+            for module in (model.input_encoder, model.z_encoder, model.l_encoder)
+            if module is not None
+        ]
+        self.params = [
+            p
+            for p in chain(*(module.parameters() for module in self.adapted_modules))
+            if p.requires_grad
+        ]
+        self.adapted_states = [
+            copy.deepcopy(module.state_dict()) for module in self.adapted_modules
+        ]
         self.n_scale = len(self.test_set.indices)
 
     @property
@@ -184,8 +194,8 @@ class AdapterTrainer(UnsupervisedTrainer):
     def train(self, n_path=10, n_epochs=50, **kwargs):
         for i in range(n_path):
             # Re-initialize to create new path
-            self.model.z_encoder.load_state_dict(self.z_encoder_state)
-            self.model.l_encoder.load_state_dict(self.l_encoder_state)
+            for module, state in zip(self.adapted_modules, self.adapted_states):
+                module.load_state_dict(state)
             super().train(n_epochs, params=self.params, **kwargs)
 
         return min(self.history["elbo_test_set"])
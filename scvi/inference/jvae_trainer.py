@@ -150,7 +150,7 @@ class JVAETrainer(Trainer):
     def training_extras_init(self, lr_d=1e-3, eps=0.01):
         self.discriminator.train()
 
-        d_params = filter(lambda p: p.requires_grad, self.discriminator.parameters())
+        d_params = [p for p in self.discriminator.parameters() if p.requires_grad]
         self.d_optimizer = torch.optim.Adam(d_params, lr=lr_d, eps=eps)
         self.train_discriminator = self.n_dataset > 1 and self.kappa > 0
 
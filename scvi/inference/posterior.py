@@ -200,9 +200,11 @@ class Posterior:
     def to_cuda(self, tensors: List[torch.Tensor]) -> List[torch.Tensor]:
         """Converts list of tensors to cuda.
 
+        The copies are non-blocking, which only makes them asynchronous when the data loader pins memory.
+
         :param tensors: tensors to convert
         """
-        return [t.cuda() if self.use_cuda else t for t in tensors]
+        return [t.cuda(non_blocking=True) if self.use_cuda else t for t in tensors]
 
     def update(self, data_loader_kwargs: dict) -> "Posterior":
         """Updates the dataloader
@@ -1288,7 +1290,7 @@ class Posterior:
             if len(px_r.size()) == 2:
                 px_dispersion = px_r
             else:
-                px_dispersion = torch.ones_like(sample_batch) * px_r
+                px_dispersion = px_r.expand_as(sample_batch)
 
             # This gamma is really l*w using scVI manuscript notation
             p = rate / (rate + px_dispersion)
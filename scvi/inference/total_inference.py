@@ -12,6 +12,7 @@ from . import UnsupervisedTrainer
 
 from scvi.dataset import GeneExpressionDataset
 from scvi.models import TOTALVI, Classifier
+from scvi.models.log_likelihood import importance_log_ratio
 from scvi.models.utils import one_hot
 
 logger = logging.getLogger(__name__)
@@ -238,26 +239,27 @@ class TotalPosterior(Posterior):
                 ) = self.model.get_reconstruction_loss(x, y, px_, py_)
 
                 # Log-probabilities
-                p_l_gene = (
-                    Normal(local_l_mean, local_l_var.sqrt())
-                    .log_prob(log_library)
-                    .sum(dim=-1)
-                )
-                p_z = Normal(0, 1).log_prob(z).sum(dim=-1)
                 p_mu_back = self.model.back_mean_prior.log_prob(log_pro_back_mean).sum(
                     dim=-1
                 )
                 p_xy_zl = -(reconst_loss_gene + reconst_loss_protein)
-                q_z_x = Normal(qz_m, qz_v.sqrt()).log_prob(z).sum(dim=-1)
-                q_l_x = Normal(ql_m, ql_v.sqrt()).log_prob(log_library).sum(dim=-1)
                 q_mu_back = (
                     Normal(py_["back_alpha"], py_["back_beta"])
                     .log_prob(log_pro_back_mean)
                     .sum(dim=-1)
                 )
-                to_sum[:, i] = (
-                    p_z + p_l_gene + p_mu_back + p_xy_zl - q_z_x - q_l_x - q_mu_back
+                log_ratio_zl = importance_log_ratio(
+                    p_xy_zl,
+                    z,
+                    qz_m,
+                    qz_v,
+                    log_library,
+                    ql_m,
+                    ql_v,
+                    local_l_mean,
+                    local_l_var,
                 )
+                to_sum[:, i] = log_ratio_zl + p_mu_back - q_mu_back
 
             batch_log_lkl = torch.logsumexp(to_sum, dim=-1) - np.log(n_samples_mc)
             log_lkl += torch.sum(batch_log_lkl).item()
@@ -337,11 +339,11 @@ class TotalPosterior(Posterior):
             if len(px_["r"].size()) == 2:
                 px_dispersion = px_["r"]
             else:
-                px_dispersion = torch.ones_like(x) * px_["r"]
+                px_dispersion = px_["r"].expand_as(x)
             if len(py_["r"].size()) == 2:
                 py_dispersion = py_["r"]
             else:
-                py_dispersion = torch.ones_like(y) * py_["r"]
+                py_dispersion = py_["r"].expand_as(y)
 
             dispersion = torch.cat((px_dispersion, py_dispersion), dim=-1)
 
@@ -640,11 +642,11 @@ class TotalPosterior(Posterior):
             if len(px_["r"].size()) == 2:
                 px_dispersion = px_["r"]
             else:
-                px_dispersion = torch.ones_like(x) * px_["r"]
+                px_dispersion = px_["r"].expand_as(x)
             if len(py_["r"].size()) == 2:
                 py_dispersion = py_["r"]
             else:
-                py_dispersion = torch.ones_like(y) * py_["r"]
+                py_dispersion = py_["r"].expand_as(y)
 
             dispersion = torch.cat((px_dispersion, py_dispersion), dim=-1)
 
@@ -1172,9 +1174,7 @@ class TotalTrainer(UnsupervisedTrainer):
         if self.discriminator is not None:
             self.discriminator.train()
 
-            d_params = filter(
-                lambda p: p.requires_grad, self.discriminator.parameters()
-            )
+            d_params = [p for p in self.discriminator.parameters() if p.requires_grad]
             self.d_optimizer = torch.optim.Adam(d_params, lr=lr_d, eps=eps)
 
     def training_extras_end(self):
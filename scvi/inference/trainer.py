@@ -30,7 +30,8 @@ class Trainer:
 
     :param model: A model instance from class ``VAE``, ``VAEC``, ``SCANVI``
     :param gene_dataset: A gene_dataset instance like ``CortexDataset()``
-    :param use_cuda: Default: ``True``.
+    :param use_cuda: Default: ``True``. Minibatches are then loaded into pinned memory so that their copy to the
+        GPU runs asynchronously, overlapping with the previous training step.
     :param metrics_to_monitor: A list of the metrics to monitor. If not specified, will use the
         ``default_metrics_to_monitor`` as specified in each . Default: ``None``.
     :param benchmark: if True, prevents statistics computation in the training. Default: ``False``.
@@ -42,6 +43,8 @@ class Trainer:
         should be specified if any of them is. Default: ``None``.
     :param show_progbar: If False, disables progress bar.
     :param seed: Random seed for train/test/validate split
+    :param compile_model: If True, compiles the model's forward pass with ``torch.compile`` (requires
+        ``torch>=2.2``). The model is compiled in place, so its parameters and ``state_dict`` keys are unchanged.
     """
 
     default_metrics_to_monitor = []
@@ -61,6 +64,7 @@ class Trainer:
         batch_size: int = 128,
         seed: int = 0,
         max_nans: int = 10,
+        compile_model: bool = False,
     ):
 
         # Model, dataset management
@@ -71,10 +75,18 @@ class Trainer:
         self.use_cuda = use_cuda and torch.cuda.is_available()
         if self.use_cuda:
             self.model.cuda()
+        if compile_model:
+            if not hasattr(self.model, "compile"):
+                raise ValueError("compile_model requires torch>=2.2")
+            # dynamic shapes avoid recompiling for the smaller last minibatch
+            self.model.compile(dynamic=True)
 
         # Data loader attributes
         self.batch_size = batch_size
-        self.data_loader_kwargs = {"batch_size": batch_size, "pin_memory": use_cuda}
+        self.data_loader_kwargs = {
+            "batch_size": batch_size,
+            "pin_memory": self.use_cuda,
+        }
         data_loader_kwargs = data_loader_kwargs if data_loader_kwargs else dict()
         self.data_loader_kwargs.update(data_loader_kwargs)
 
@@ -147,7 +159,7 @@ class Trainer:
         self.model.train()
 
         if params is None:
-            params = filter(lambda p: p.requires_grad, self.model.parameters())
+            params = [p for p in self.model.parameters() if p.requires_grad]
 
         self.optimizer = torch.optim.Adam(
             params, lr=lr, eps=eps, weight_decay=self.weight_decay
@@ -1,17 +1,16 @@
 import torch
 import torch.nn.functional as F
-from torch.distributions import Normal, Beta, Gamma, kl_divergence as kl
+from torch.distributions import Beta, Gamma, kl_divergence as kl
 import numpy as np
 from scipy.special import logit
 
 from scvi.models.distributions import ZeroInflatedNegativeBinomial, NegativeBinomial
+from scvi.models.log_likelihood import gaussian_kl, standard_gaussian_kl
 from scvi.models.vae import VAE
 from scvi.models.utils import one_hot
 
 from typing import Dict, Optional, Tuple, Union
 
-torch.backends.cudnn.benchmark = True
-
 
 class AutoZIVAE(VAE):
     def __init__(
@@ -373,16 +372,8 @@ class AutoZIVAE(VAE):
         bernoulli_params = outputs["bernoulli_params"]
 
         # KL divergences wrt z_n,l_n
-        mean = torch.zeros_like(qz_m)
-        scale = torch.ones_like(qz_v)
-
-        kl_divergence_z = kl(Normal(qz_m, torch.sqrt(qz_v)), Normal(mean, scale)).sum(
-            dim=1
-        )
-        kl_divergence_l = kl(
-            Normal(ql_m, torch.sqrt(ql_v)),
-            Normal(local_l_mean, torch.sqrt(local_l_var)),
-        ).sum(dim=1)
+        kl_divergence_z = standard_gaussian_kl(qz_m, qz_v).sum(dim=1)
+        kl_divergence_l = gaussian_kl(ql_m, ql_v, local_l_mean, local_l_var).sum(dim=1)
 
         # KL divergence wrt Bernoulli parameters
         kl_divergence_bernoulli = self.compute_global_kl_divergence()
@@ -18,8 +18,6 @@ from scvi.models.modules import Encoder
 from scvi.models.modules import MultiEncoder, MultiDecoder
 from scvi.models.utils import one_hot
 
-torch.backends.cudnn.benchmark = True
-
 
 class JVAE(nn.Module):
     """Joint Variational auto-encoder for imputing missing genes in spatial data
@@ -279,7 +277,7 @@ class JVAE(nn.Module):
     ]:
         x_ = x
         if self.log_variational:
-            x_ = torch.log(1 + x_)
+            x_ = torch.log1p(x_)
 
         qz_m, qz_v, z = self.z_encoder(x_, mode)
         ql_m, ql_v, library = None, None, None
@@ -4,7 +4,11 @@ import numpy as np
 import torch
 import torch.nn.functional as F
 from torch import logsumexp
-from torch.distributions import Normal, Beta
+from torch.distributions import Beta
+
+from typing import Optional
+
+_LOG_2PI = float(np.log(2 * np.pi))
 
 
 def compute_elbo(vae, posterior, **kwargs):
@@ -111,17 +115,10 @@ def compute_marginal_log_likelihood_scvi(vae, posterior, n_samples_mc=100):
             )
 
             # Log-probabilities
-            p_l = Normal(local_l_mean, local_l_var.sqrt()).log_prob(library).sum(dim=-1)
-            p_z = (
-                Normal(torch.zeros_like(qz_m), torch.ones_like(qz_v))
-                .log_prob(z)
-                .sum(dim=-1)
-            )
             p_x_zl = -reconst_loss
-            q_z_x = Normal(qz_m, qz_v.sqrt()).log_prob(z).sum(dim=-1)
-            q_l_x = Normal(ql_m, ql_v.sqrt()).log_prob(library).sum(dim=-1)
-
-            to_sum[:, i] = p_z + p_l + p_x_zl - q_z_x - q_l_x
+            to_sum[:, i] = importance_log_ratio(
+                p_x_zl, z, qz_m, qz_v, library, ql_m, ql_v, local_l_mean, local_l_var
+            )
 
         batch_log_lkl = logsumexp(to_sum, dim=-1) - np.log(n_samples_mc)
         log_lkl += torch.sum(batch_log_lkl).item()
@@ -179,17 +176,12 @@ def compute_marginal_log_likelihood_autozi(autozivae, posterior, n_samples_mc=10
             )
 
             # Log-probabilities
-            p_l = Normal(local_l_mean, local_l_var.sqrt()).log_prob(library).sum(dim=-1)
-            p_z = (
-                Normal(torch.zeros_like(qz_m), torch.ones_like(qz_v))
-                .log_prob(z)
-                .sum(dim=-1)
-            )
             p_x_zld = -reconst_loss
-            q_z_x = Normal(qz_m, qz_v.sqrt()).log_prob(z).sum(dim=-1)
-            q_l_x = Normal(ql_m, ql_v.sqrt()).log_prob(library).sum(dim=-1)
+            log_ratio = importance_log_ratio(
+                p_x_zld, z, qz_m, qz_v, library, ql_m, ql_v, local_l_mean, local_l_var
+            )
 
-            batch_log_lkl = torch.sum(p_x_zld + p_l + p_z - q_z_x - q_l_x, dim=0)
+            batch_log_lkl = torch.sum(log_ratio, dim=0)
             to_sum[i] += batch_log_lkl
 
         p_d = Beta(alpha_prior, beta_prior).log_prob(bernoulli_params).sum()
@@ -203,12 +195,21 @@ def compute_marginal_log_likelihood_autozi(autozivae, posterior, n_samples_mc=10
     return -log_lkl / n_samples
 
 
-def log_zinb_positive(x, mu, theta, pi, eps=1e-8):
+@torch.jit.script
+def log_zinb_positive(
+    x: torch.Tensor,
+    mu: torch.Tensor,
+    theta: torch.Tensor,
+    pi: torch.Tensor,
+    eps: float = 1e-8,
+):
     """
     Note: All inputs are torch Tensors
     log likelihood (scalar) of a minibatch according to a zinb model.
     Notes:
-    We parametrize the bernoulli using the logits, hence the softplus functions appearing
+    We parametrize the bernoulli using the logits, hence the softplus functions appearing.
+    The function is scripted so that the elementwise terms below are fused into a single
+    pass over the ``(minibatch, genes)`` tensors rather than one allocation per term.
 
     Variables:
     mu: mean of the negative binomial (has to be positive support) (shape: minibatch x genes)
@@ -216,21 +217,14 @@ def log_zinb_positive(x, mu, theta, pi, eps=1e-8):
     pi: logit of the dropout parameter (real support) (shape: minibatch x genes)
     eps: numerical stability constant
     """
-
-    # theta is the dispersion rate. If .ndimension() == 1, it is shared for all cells (regardless of batch or labels)
-    if theta.ndimension() == 1:
-        theta = theta.view(
-            1, theta.size(0)
-        )  # In this case, we reshape theta for broadcasting
-
-    softplus_pi = F.softplus(-pi)  #  uses log(sigmoid(x)) = -softplus(-x)
+    # theta is the dispersion rate. If .ndimension() == 1, it is shared for all cells
+    # (regardless of batch or labels) and broadcasts against the last dimension
+    softplus_pi = F.softplus(-pi)  # uses log(sigmoid(x)) = -softplus(-x)
     log_theta_eps = torch.log(theta + eps)
     log_theta_mu_eps = torch.log(theta + mu + eps)
     pi_theta_log = -pi + theta * (log_theta_eps - log_theta_mu_eps)
 
     case_zero = F.softplus(pi_theta_log) - softplus_pi
-    mul_case_zero = torch.mul((x < eps).type(torch.float32), case_zero)
-
     case_non_zero = (
         -softplus_pi
         + pi_theta_log
@@ -239,14 +233,16 @@ def log_zinb_positive(x, mu, theta, pi, eps=1e-8):
         - torch.lgamma(theta)
         - torch.lgamma(x + 1)
     )
-    mul_case_non_zero = torch.mul((x > eps).type(torch.float32), case_non_zero)
 
-    res = mul_case_zero + mul_case_non_zero
+    res = torch.where(x < eps, case_zero, case_non_zero)
 
     return res
 
 
-def log_nb_positive(x, mu, theta, eps=1e-8):
+@torch.jit.script
+def log_nb_positive(
+    x: torch.Tensor, mu: torch.Tensor, theta: torch.Tensor, eps: float = 1e-8
+):
     """
     Note: All inputs should be torch Tensors
     log likelihood (scalar) of a minibatch according to a nb model.
@@ -256,11 +252,7 @@ def log_nb_positive(x, mu, theta, eps=1e-8):
     theta: inverse dispersion parameter (has to be positive support) (shape: minibatch x genes)
     eps: numerical stability constant
     """
-    if theta.ndimension() == 1:
-        theta = theta.view(
-            1, theta.size(0)
-        )  # In this case, we reshape theta for broadcasting
-
+    # a 1-d theta is shared for all cells and broadcasts against the last dimension
     log_theta_mu_eps = torch.log(theta + mu + eps)
 
     res = (
@@ -274,7 +266,16 @@ def log_nb_positive(x, mu, theta, eps=1e-8):
     return res
 
 
-def log_mixture_nb(x, mu_1, mu_2, theta_1, theta_2, pi, eps=1e-8):
+@torch.jit.script
+def log_mixture_nb(
+    x: torch.Tensor,
+    mu_1: torch.Tensor,
+    mu_2: torch.Tensor,
+    theta_1: torch.Tensor,
+    theta_2: Optional[torch.Tensor],
+    pi: torch.Tensor,
+    eps: float = 1e-8,
+):
     """
     Note: All inputs should be torch Tensors
     log likelihood (scalar) of a minibatch according to a mixture nb model.
@@ -290,41 +291,129 @@ def log_mixture_nb(x, mu_1, mu_2, theta_1, theta_2, pi, eps=1e-8):
         If None, assume one shared inverse dispersion parameter.
     eps: numerical stability constant
     """
+    # the lgamma terms that do not depend on the component are computed once and
+    # factored out of the logsumexp; a 1-d theta broadcasts against the last dimension
     if theta_2 is not None:
-        log_nb_1 = log_nb_positive(x, mu_1, theta_1)
-        log_nb_2 = log_nb_positive(x, mu_2, theta_2)
-    # this is intended to reduce repeated computations
+        log_theta_mu_1_eps = torch.log(theta_1 + mu_1 + eps)
+        log_theta_mu_2_eps = torch.log(theta_2 + mu_2 + eps)
+        log_nb_1 = (
+            theta_1 * (torch.log(theta_1 + eps) - log_theta_mu_1_eps)
+            + x * (torch.log(mu_1 + eps) - log_theta_mu_1_eps)
+            + torch.lgamma(x + theta_1)
+            - torch.lgamma(theta_1)
+        )
+        log_nb_2 = (
+            theta_2 * (torch.log(theta_2 + eps) - log_theta_mu_2_eps)
+            + x * (torch.log(mu_2 + eps) - log_theta_mu_2_eps)
+            + torch.lgamma(x + theta_2)
+            - torch.lgamma(theta_2)
+        )
+        log_shared = -torch.lgamma(x + 1)
     else:
         theta = theta_1
-        if theta.ndimension() == 1:
-            theta = theta.view(
-                1, theta.size(0)
-            )  # In this case, we reshape theta for broadcasting
-
+        log_theta_eps = torch.log(theta + eps)
         log_theta_mu_1_eps = torch.log(theta + mu_1 + eps)
         log_theta_mu_2_eps = torch.log(theta + mu_2 + eps)
-        lgamma_x_theta = torch.lgamma(x + theta)
-        lgamma_theta = torch.lgamma(theta)
-        lgamma_x_plus_1 = torch.lgamma(x + 1)
 
-        log_nb_1 = (
-            theta * (torch.log(theta + eps) - log_theta_mu_1_eps)
-            + x * (torch.log(mu_1 + eps) - log_theta_mu_1_eps)
-            + lgamma_x_theta
-            - lgamma_theta
-            - lgamma_x_plus_1
+        log_nb_1 = theta * (log_theta_eps - log_theta_mu_1_eps) + x * (
+            torch.log(mu_1 + eps) - log_theta_mu_1_eps
         )
-        log_nb_2 = (
-            theta * (torch.log(theta + eps) - log_theta_mu_2_eps)
-            + x * (torch.log(mu_2 + eps) - log_theta_mu_2_eps)
-            + lgamma_x_theta
-            - lgamma_theta
-            - lgamma_x_plus_1
+        log_nb_2 = theta * (log_theta_eps - log_theta_mu_2_eps) + x * (
+            torch.log(mu_2 + eps) - log_theta_mu_2_eps
         )
+        log_shared = torch.lgamma(x + theta) - torch.lgamma(theta) - torch.lgamma(x + 1)
 
-    logsumexp = torch.logsumexp(torch.stack((log_nb_1, log_nb_2 - pi)), dim=0)
+    log_sum = torch.logsumexp(torch.stack((log_nb_1, log_nb_2 - pi)), dim=0)
     softplus_pi = F.softplus(-pi)
 
-    log_mixture_nb = logsumexp - softplus_pi
+    return log_sum + log_shared - softplus_pi
+
+
+@torch.jit.script
+def log_gaussian(x: torch.Tensor, m: torch.Tensor, v: torch.Tensor):
+    """
+    Note: All inputs should be torch Tensors
+    log likelihood (elementwise) of x under a diagonal gaussian model.
+    Equivalent to ``Normal(m, v.sqrt()).log_prob(x)`` without building the distribution.
+
+    Variables:
+    m: mean of the gaussian
+    v: variance of the gaussian (has to be positive support)
+    """
+    return -0.5 * (_LOG_2PI + torch.log(v) + (x - m) * (x - m) / v)
+
+
+@torch.jit.script
+def gaussian_kl(
+    m1: torch.Tensor, v1: torch.Tensor, m2: torch.Tensor, v2: torch.Tensor
+):
+    """
+    Note: All inputs should be torch Tensors
+    KL divergence (elementwise) between two diagonal gaussians, KL(N(m1, v1) || N(m2, v2)).
+    Equivalent to ``kl_divergence(Normal(m1, v1.sqrt()), Normal(m2, v2.sqrt()))``.
+
+    Variables:
+    m1, v1: mean and variance of the first gaussian
+    m2, v2: mean and variance of the second gaussian
+    """
+    var_ratio = v1 / v2
+    return 0.5 * (var_ratio + (m1 - m2) * (m1 - m2) / v2 - 1.0 - torch.log(var_ratio))
+
+
+@torch.jit.script
+def log_standard_gaussian(x: torch.Tensor):
+    """
+    Note: All inputs should be torch Tensors
+    log likelihood (elementwise) of x under the standard gaussian prior N(0, I).
+    Equivalent to ``log_gaussian(x, zeros_like(x), ones_like(x))`` without allocating the prior.
+    """
+    return -0.5 * (_LOG_2PI + x * x)
+
 
-    return log_mixture_nb
+@torch.jit.script
+def standard_gaussian_kl(m: torch.Tensor, v: torch.Tensor):
+    """
+    Note: All inputs should be torch Tensors
+    KL divergence (elementwise) between a diagonal gaussian and the standard gaussian prior,
+    KL(N(m, v) || N(0, I)).
+    Equivalent to ``gaussian_kl(m, v, zeros_like(m), ones_like(v))`` without allocating the prior.
+
+    Variables:
+    m: mean of the gaussian
+    v: variance of the gaussian (has to be positive support)
+    """
+    return 0.5 * (v + m * m - 1.0 - torch.log(v))
+
+
+@torch.jit.script
+def importance_log_ratio(
+    log_px_zl: torch.Tensor,
+    z: torch.Tensor,
+    qz_m: torch.Tensor,
+    qz_v: torch.Tensor,
+    library: torch.Tensor,
+    ql_m: torch.Tensor,
+    ql_v: torch.Tensor,
+    pl_m: torch.Tensor,
+    pl_v: torch.Tensor,
+):
+    """
+    Note: All inputs should be torch Tensors
+    log importance weight log p(x, z, l) - log q(z, l | x) (per cell) of a posterior sample (z, l),
+    under the standard gaussian prior on z and the gaussian prior on l.
+    Equivalent to summing the ``log_gaussian`` and ``log_standard_gaussian`` terms over
+    the last dimension, but in one pass where the log(2 pi) normalizations cancel out.
+
+    Variables:
+    log_px_zl: log likelihood of the data given z and l (shape: minibatch)
+    qz_m, qz_v: mean and variance of the variational posterior of z
+    ql_m, ql_v: mean and variance of the variational posterior of l
+    pl_m, pl_v: mean and variance of the prior of l
+    """
+    log_ratio_z = (torch.log(qz_v) + (z - qz_m) * (z - qz_m) / qz_v - z * z).sum(dim=-1)
+    log_ratio_l = (
+        torch.log(ql_v / pl_v)
+        + (library - ql_m) * (library - ql_m) / ql_v
+        - (library - pl_m) * (library - pl_m) / pl_v
+    ).sum(dim=-1)
+    return log_px_zl + 0.5 * (log_ratio_z + log_ratio_l)
@@ -17,6 +17,40 @@ def identity(x):
     return x
 
 
+def sparse_linear(layer: nn.Linear, x: torch.Tensor, *cat_list: torch.Tensor):
+    r"""Applies ``layer`` to the concatenation of a sparse ``x`` and dense one-hot covariates.
+
+    Only the non-zero entries of ``x`` are used, and ``x`` is never densified: each row is computed
+    as an embedding bag, i.e. the sum of the weight columns of its non-zero genes scaled by their values.
+
+    :param layer: linear layer whose input is ``x`` followed by the covariates
+    :param x: sparse COO tensor with shape ``(batch_size, n_in)``
+    :param cat_list: one-hot encoded covariates with shape ``(batch_size, n_cat)``
+    :return: tensor of shape ``(batch_size, n_out)``
+    """
+    n_in = x.size(-1)
+    if not x.is_coalesced():
+        x = x.coalesce()
+    rows, cols = x.indices()
+    # coalesced indices are sorted by row, so each cell's bag starts after the previous ones
+    counts = torch.bincount(rows, minlength=x.size(0))
+    offsets = torch.cumsum(counts, dim=0) - counts
+    out = nn.functional.embedding_bag(
+        cols,
+        layer.weight[:, :n_in].t(),
+        offsets,
+        mode="sum",
+        per_sample_weights=x.values(),
+    )
+    if len(cat_list):
+        out = out + nn.functional.linear(
+            torch.cat(cat_list, dim=-1), layer.weight[:, n_in:]
+        )
+    if layer.bias is not None:
+        out = out + layer.bias
+    return out
+
+
 class FCLayers(nn.Module):
     r"""A helper class to build fully-connected layers for a neural network.
 
@@ -83,7 +117,7 @@ class FCLayers(nn.Module):
     def forward(self, x: torch.Tensor, *cat_list: int, instance_id: int = 0):
         r"""Forward computation on ``x``.
 
-        :param x: tensor of values with shape ``(n_in,)``
+        :param x: tensor of values with shape ``(n_in,)``, possibly a sparse COO tensor
         :param cat_list: list of category membership(s) for this sample
         :param instance_id: Use a specific conditional instance normalization (batchnorm)
         :return: tensor of shape ``(n_out,)``
@@ -113,6 +147,8 @@ class FCLayers(nn.Module):
                             )
                         else:
                             x = layer(x)
+                    elif isinstance(layer, nn.Linear) and x.is_sparse:
+                        x = sparse_linear(layer, x, *one_hot_cat_list)
                     else:
                         if isinstance(layer, nn.Linear):
                             if x.dim() == 3:
@@ -2,9 +2,10 @@ from typing import Sequence
 
 import numpy as np
 import torch
-from torch.distributions import Normal, Categorical, kl_divergence as kl
+from torch.distributions import Categorical, kl_divergence as kl
 
 from scvi.models.classifier import Classifier
+from scvi.models.log_likelihood import gaussian_kl, log_gaussian, standard_gaussian_kl
 from scvi.models.modules import Decoder, Encoder
 from scvi.models.utils import broadcast_labels
 from scvi.models.vae import VAE
@@ -137,8 +138,7 @@ class SCANVI(VAE):
             )
 
     def classify(self, x):
-        if self.log_variational:
-            x = torch.log(1 + x)
+        x = self.encoder_input(x)
         qz_m, _, z = self.z_encoder(x)
         # We classify using the inferred mean parameter of z_1 in the latent space
         z = qz_m
@@ -184,18 +184,10 @@ class SCANVI(VAE):
         reconst_loss = self.get_reconstruction_loss(x, px_rate, px_r, px_dropout)
 
         # KL Divergence
-        mean = torch.zeros_like(qz2_m)
-        scale = torch.ones_like(qz2_v)
-
-        kl_divergence_z2 = kl(
-            Normal(qz2_m, torch.sqrt(qz2_v)), Normal(mean, scale)
-        ).sum(dim=1)
-        loss_z1_unweight = -Normal(pz1_m, torch.sqrt(pz1_v)).log_prob(z1s).sum(dim=-1)
-        loss_z1_weight = Normal(qz1_m, torch.sqrt(qz1_v)).log_prob(z1).sum(dim=-1)
-        kl_divergence_l = kl(
-            Normal(ql_m, torch.sqrt(ql_v)),
-            Normal(local_l_mean, torch.sqrt(local_l_var)),
-        ).sum(dim=1)
+        kl_divergence_z2 = standard_gaussian_kl(qz2_m, qz2_v).sum(dim=1)
+        loss_z1_unweight = -log_gaussian(z1s, pz1_m, pz1_v).sum(dim=-1)
+        loss_z1_weight = log_gaussian(z1, qz1_m, qz1_v).sum(dim=-1)
+        kl_divergence_l = gaussian_kl(ql_m, ql_v, local_l_mean, local_l_var).sum(dim=1)
 
         if is_labelled:
             return (
@@ -13,8 +13,6 @@ from scvi.models.modules import DecoderTOTALVI, EncoderTOTALVI
 from scvi.models.utils import one_hot
 import numpy as np
 
-torch.backends.cudnn.benchmark = True
-
 
 # VAE model
 class TOTALVI(nn.Module):
@@ -164,8 +162,8 @@ class TOTALVI(nn.Module):
         :return: tensor of shape ``(batch_size, n_latent)``
         """
         if self.log_variational:
-            x = torch.log(1 + x)
-            y = torch.log(1 + y)
+            x = torch.log1p(x)
+            y = torch.log1p(y)
         qz_m, qz_v, _, _, latent, _ = self.encoder(
             torch.cat((x, y), dim=-1), batch_index
         )
@@ -193,8 +191,8 @@ class TOTALVI(nn.Module):
         :return: tensor of shape ``(batch_size, 1)``
         """
         if self.log_variational:
-            x = torch.log(1 + x)
-            y = torch.log(1 + y)
+            x = torch.log1p(x)
+            y = torch.log1p(y)
         _, _, ql_m, ql_v, latent, _ = self.encoder(
             torch.cat((x, y), dim=-1), batch_index
         )
@@ -365,8 +363,8 @@ class TOTALVI(nn.Module):
         x_ = x
         y_ = y
         if self.log_variational:
-            x_ = torch.log(1 + x_)
-            y_ = torch.log(1 + y_)
+            x_ = torch.log1p(x_)
+            y_ = torch.log1p(y_)
 
         # Sampling - Encoder gets concatenated genes + proteins
         qz_m, qz_v, ql_m, ql_v, latent, untran_latent = self.encoder(
@@ -420,7 +418,7 @@ class TOTALVI(nn.Module):
         self.back_mean_prior = Normal(py_back_alpha_prior, py_back_beta_prior)
 
         if transform_batch is not None:
-            batch_index = torch.ones_like(batch_index) * transform_batch
+            batch_index = torch.full_like(batch_index, transform_batch)
         px_, py_, log_pro_back_mean = self.decoder(z, library_gene, batch_index, label)
         px_["r"] = px_r
         py_["r"] = py_r
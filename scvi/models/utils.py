@@ -39,7 +39,7 @@ def one_hot(index, n_cat):
 
 def enumerate_discrete(x, y_dim):
     def batch(batch_size, label):
-        labels = torch.ones(batch_size, 1, device=x.device, dtype=torch.long) * label
+        labels = torch.full((batch_size, 1), label, device=x.device, dtype=torch.long)
         return one_hot(labels, y_dim)
 
     batch_size = x.size(0)
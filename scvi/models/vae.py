@@ -4,20 +4,35 @@
 import numpy as np
 import torch
 import torch.nn as nn
-import torch.nn.functional as F
-from torch.distributions import Normal, kl_divergence as kl
+from torch.distributions import Normal
+from torch.utils.checkpoint import checkpoint
 
 from scvi.models.distributions import (
     ZeroInflatedNegativeBinomial,
     NegativeBinomial,
     Poisson,
 )
-from scvi.models.modules import Encoder, DecoderSCVI, LinearDecoderSCVI
-from scvi.models.utils import one_hot
+from scvi.models.log_likelihood import gaussian_kl, standard_gaussian_kl
+from scvi.models.modules import Encoder, DecoderSCVI, FCLayers, LinearDecoderSCVI
 
 from typing import Tuple, Dict
 
-torch.backends.cudnn.benchmark = True
+
+@torch.jit.script
+def _kl_divergences_zl(
+    qz_m: torch.Tensor,
+    qz_v: torch.Tensor,
+    ql_m: torch.Tensor,
+    ql_v: torch.Tensor,
+    pl_m: torch.Tensor,
+    pl_v: torch.Tensor,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Returns the per-cell KL divergences of z to N(0, I) and of l to N(pl_m, pl_v),
+    scripted together so that both reductions are scheduled in a single graph
+    """
+    kl_divergence_z = standard_gaussian_kl(qz_m, qz_v).sum(dim=1)
+    kl_divergence_l = gaussian_kl(ql_m, ql_v, pl_m, pl_v).sum(dim=1)
+    return kl_divergence_z, kl_divergence_l
 
 
 # VAE model
@@ -47,6 +62,22 @@ class VAE(nn.Module):
         * ``'zinb'`` - Zero-inflated negative binomial distribution
         * ``'poisson'`` - Poisson distribution
 
+    :param shared_input_layer: If True, a fully-connected layer on the ``n_input``-dimensional data is
+        shared by the z and library encoders, which then operate on its ``n_hidden`` outputs. This layer is
+        the widest matmul of the encoders and is then computed once per forward pass. Note that it is added
+        in front of the encoders, which keep their own layers: each encoder is one hidden layer deeper than
+        without this option, so the architecture (and the saved parameters) differ.
+    :param sparse_input: If True, the data is passed to the encoders as a sparse tensor, so that the
+        log-transform and the first encoder layer only process the non-zero counts (requires
+        ``torch>=1.2``). Worthwhile for very sparse data.
+    :param mixed_precision: If True, the encoders and the decoder run under ``torch.autocast`` with
+        ``bfloat16`` (requires ``torch>=1.10``). Their outputs are cast back to ``float32``, so the
+        likelihood and KL divergences are still computed in full precision.
+    :param use_checkpoint: If True, the activations of the z encoder and of the decoder are not kept for the
+        backward pass but recomputed during it (gradient checkpointing, requires ``torch>=1.11``). This
+        trades some compute for a much smaller memory footprint, allowing larger minibatches. The
+        recomputation does not update the batch norm running statistics a second time.
+
     Examples:
         >>> gene_dataset = CortexDataset()
         >>> vae = VAE(gene_dataset.nb_genes, n_batch=gene_dataset.n_batches * False,
@@ -67,11 +98,18 @@ class VAE(nn.Module):
         log_variational: bool = True,
         reconstruction_loss: str = "zinb",
         latent_distribution: str = "normal",
+        shared_input_layer: bool = False,
+        sparse_input: bool = False,
+        mixed_precision: bool = False,
+        use_checkpoint: bool = False,
     ):
         super().__init__()
         self.dispersion = dispersion
         self.n_latent = n_latent
         self.log_variational = log_variational
+        self.sparse_input = sparse_input
+        self.mixed_precision = mixed_precision
+        self.use_checkpoint = use_checkpoint
         self.reconstruction_loss = reconstruction_loss
         # Automatically deactivate if useless
         self.n_batch = n_batch
@@ -93,10 +131,25 @@ class VAE(nn.Module):
                 "{}.format(self.dispersion)"
             )
 
+        # optional extra first layer shared by the z and l encoders, which
+        # keep all their own layers on top of it
+        if shared_input_layer:
+            self.input_encoder = FCLayers(
+                n_in=n_input,
+                n_out=n_hidden,
+                n_layers=1,
+                n_hidden=n_hidden,
+                dropout_rate=dropout_rate,
+            )
+            n_input_encoder = n_hidden
+        else:
+            self.input_encoder = None
+            n_input_encoder = n_input
+
         # z encoder goes from the n_input-dimensional data to an n_latent-d
         # latent space representation
         self.z_encoder = Encoder(
-            n_input,
+            n_input_encoder,
             n_latent,
             n_layers=n_layers,
             n_hidden=n_hidden,
@@ -105,7 +158,11 @@ class VAE(nn.Module):
         )
         # l encoder goes from n_input-dimensional data to 1-d library size
         self.l_encoder = Encoder(
-            n_input, 1, n_layers=1, n_hidden=n_hidden, dropout_rate=dropout_rate
+            n_input_encoder,
+            1,
+            n_layers=1,
+            n_hidden=n_hidden,
+            dropout_rate=dropout_rate,
         )
         # decoder goes from n_latent-dimensional space to n_input-d data
         self.decoder = DecoderSCVI(
@@ -116,6 +173,29 @@ class VAE(nn.Module):
             n_hidden=n_hidden,
         )
 
+    def encoder_input(self, x) -> torch.Tensor:
+        """Returns the input of ``z_encoder`` and ``l_encoder`` for the data ``x``
+
+        :param x: tensor of values with shape ``(batch_size, n_input)``, possibly a sparse COO tensor
+        :return: tensor of shape ``(batch_size, n_input)``, or ``(batch_size, n_hidden)`` if the
+         input layer is shared
+        """
+        if self.sparse_input and not x.is_sparse:
+            x = x.to_sparse()
+        if x.is_sparse:
+            x = x.coalesce()
+            if self.log_variational:
+                # log1p keeps zeros at zero, only the stored values need transforming;
+                # the indices are unchanged, so the encoders need not coalesce again
+                x = torch.sparse_coo_tensor(
+                    x.indices(), torch.log1p(x.values()), x.size()
+                )._coalesced_(True)
+        elif self.log_variational:
+            x = torch.log1p(x)
+        if self.input_encoder is not None:
+            x = self.input_encoder(x)
+        return x
+
     def get_latents(self, x, y=None) -> torch.Tensor:
         """Returns the result of ``sample_from_posterior_z`` inside a list
 
@@ -136,8 +216,7 @@ class VAE(nn.Module):
         :param n_samples: how many MC samples to average over for transformed mean
         :return: tensor of shape ``(batch_size, n_latent)``
         """
-        if self.log_variational:
-            x = torch.log(1 + x)
+        x = self.encoder_input(x)
         qz_m, qz_v, z = self.z_encoder(x, y)  # y only used in VAEC
         if give_mean:
             if self.latent_distribution == "ln":
@@ -155,8 +234,7 @@ class VAE(nn.Module):
         :param y: tensor of cell-types labels with shape ``(batch_size, n_labels)``
         :return: tensor of shape ``(batch_size, 1)``
         """
-        if self.log_variational:
-            x = torch.log(1 + x)
+        x = self.encoder_input(x)
         ql_m, ql_v, library = self.l_encoder(x)
         return library
 
@@ -222,46 +300,83 @@ class VAE(nn.Module):
             reconst_loss = -Poisson(px_rate).log_prob(x).sum(dim=-1)
         return reconst_loss
 
+    def _checkpointed(self, module: nn.Module, *inputs):
+        """Calls ``module`` on ``inputs``, checkpointed if ``use_checkpoint`` is set
+        """
+        if not (self.use_checkpoint and torch.is_grad_enabled()):
+            return module(*inputs)
+        recomputing = [False]
+
+        def run(*args):
+            if not recomputing[0]:
+                recomputing[0] = True
+                return module(*args)
+            # the recomputation during backward runs in train mode as well, restore the
+            # batch norm statistics so that they are only updated once per step
+            buffers = [buffer.clone() for buffer in module.buffers()]
+            try:
+                return module(*args)
+            finally:
+                with torch.no_grad():
+                    for buffer, saved in zip(module.buffers(), buffers):
+                        buffer.copy_(saved)
+
+        # the RNG state is restored on recomputation, so z is sampled identically
+        return checkpoint(run, *inputs, use_reentrant=False)
+
     def inference(
         self, x, batch_index=None, y=None, n_samples=1, transform_batch=None
     ) -> Dict[str, torch.Tensor]:
         """Helper function used in forward pass
         """
-        x_ = x
-        if self.log_variational:
-            x_ = torch.log(1 + x_)
+        if self.mixed_precision:
+            with torch.autocast(x.device.type, dtype=torch.bfloat16):
+                outputs = self._inference(x, batch_index, y, n_samples, transform_batch)
+            # lgamma and the KL divergences need float32
+            return {key: value.float() for key, value in outputs.items()}
+        return self._inference(x, batch_index, y, n_samples, transform_batch)
+
+    def _inference(
+        self, x, batch_index=None, y=None, n_samples=1, transform_batch=None
+    ) -> Dict[str, torch.Tensor]:
+        x_ = self.encoder_input(x)
 
         # Sampling
-        qz_m, qz_v, z = self.z_encoder(x_, y)
+        qz_m, qz_v, z = self._checkpointed(self.z_encoder, x_, y)
         ql_m, ql_v, library = self.l_encoder(x_)
 
         if n_samples > 1:
-            qz_m = qz_m.unsqueeze(0).expand((n_samples, qz_m.size(0), qz_m.size(1)))
-            qz_v = qz_v.unsqueeze(0).expand((n_samples, qz_v.size(0), qz_v.size(1)))
+            # the sample dimension is prepended by broadcasting, the posterior
+            # parameters keep their (batch_size, n_latent) shape
             # when z is normal, untran_z == z
-            untran_z = Normal(qz_m, qz_v.sqrt()).sample()
+            untran_z = Normal(qz_m, qz_v.sqrt()).sample((n_samples,))
             z = self.z_encoder.z_transformation(untran_z)
-            ql_m = ql_m.unsqueeze(0).expand((n_samples, ql_m.size(0), ql_m.size(1)))
-            ql_v = ql_v.unsqueeze(0).expand((n_samples, ql_v.size(0), ql_v.size(1)))
-            library = Normal(ql_m, ql_v.sqrt()).sample()
+            library = Normal(ql_m, ql_v.sqrt()).sample((n_samples,))
 
         if transform_batch is not None:
-            dec_batch_index = transform_batch * torch.ones_like(batch_index)
+            dec_batch_index = torch.full_like(batch_index, transform_batch)
         else:
             dec_batch_index = batch_index
 
-        px_scale, px_r, px_rate, px_dropout = self.decoder(
-            self.dispersion, z, library, dec_batch_index, y
+        px_scale, px_r, px_rate, px_dropout = self._checkpointed(
+            self.decoder, self.dispersion, z, library, dec_batch_index, y
         )
+        # Exponentiate the dispersions before selecting them per cell so the exp runs
+        # over (n_input, n_cat) values, then gather the row of each cell's category.
+        # px_r gets transposed - last dimension is nb genes
         if self.dispersion == "gene-label":
-            px_r = F.linear(
-                one_hot(y, self.n_labels), self.px_r
-            )  # px_r gets transposed - last dimension is nb genes
+            px_r = torch.exp(self.px_r).t().index_select(0, y.view(-1).long())
         elif self.dispersion == "gene-batch":
-            px_r = F.linear(one_hot(dec_batch_index, self.n_batch), self.px_r)
+            px_r = (
+                torch.exp(self.px_r)
+                .t()
+                .index_select(0, dec_batch_index.view(-1).long())
+            )
         elif self.dispersion == "gene":
-            px_r = self.px_r
-        px_r = torch.exp(px_r)
+            px_r = torch.exp(self.px_r)
+        else:
+            # decoded in bfloat16 under mixed precision, exp would overflow
+            px_r = torch.exp(px_r.float())
 
         return dict(
             px_scale=px_scale,
@@ -301,16 +416,9 @@ class VAE(nn.Module):
         px_dropout = outputs["px_dropout"]
 
         # KL Divergence
-        mean = torch.zeros_like(qz_m)
-        scale = torch.ones_like(qz_v)
-
-        kl_divergence_z = kl(Normal(qz_m, torch.sqrt(qz_v)), Normal(mean, scale)).sum(
-            dim=1
+        kl_divergence_z, kl_divergence_l = _kl_divergences_zl(
+            qz_m, qz_v, ql_m, ql_v, local_l_mean, local_l_var
         )
-        kl_divergence_l = kl(
-            Normal(ql_m, torch.sqrt(ql_v)),
-            Normal(local_l_mean, torch.sqrt(local_l_var)),
-        ).sum(dim=1)
         kl_divergence = kl_divergence_z
 
         reconst_loss = self.get_reconstruction_loss(x, px_rate, px_r, px_dropout)
@@ -1,7 +1,8 @@
 import torch
-from torch.distributions import Normal, Categorical, kl_divergence as kl
+from torch.distributions import Categorical, kl_divergence as kl
 
 from scvi.models.classifier import Classifier
+from scvi.models.log_likelihood import gaussian_kl, standard_gaussian_kl
 from scvi.models.modules import Encoder, DecoderSCVI
 from scvi.models.utils import broadcast_labels
 from scvi.models.vae import VAE
@@ -98,14 +99,14 @@ class VAEC(VAE):
         )
 
     def classify(self, x):
-        x = torch.log(1 + x)
+        x = torch.log1p(x)
         return self.classifier(x)
 
     def forward(self, x, local_l_mean, local_l_var, batch_index=None, y=None):
         is_labelled = False if y is None else True
 
         # Prepare for sampling
-        x_ = torch.log(1 + x)
+        x_ = torch.log1p(x)
         ql_m, ql_v, library = self.l_encoder(x_)
 
         # Enumerate choices of label
@@ -123,16 +124,8 @@ class VAEC(VAE):
         reconst_loss = self.get_reconstruction_loss(xs, px_rate, px_r, px_dropout)
 
         # KL Divergence
-        mean = torch.zeros_like(qz_m)
-        scale = torch.ones_like(qz_v)
-
-        kl_divergence_z = kl(Normal(qz_m, torch.sqrt(qz_v)), Normal(mean, scale)).sum(
-            dim=1
-        )
-        kl_divergence_l = kl(
-            Normal(ql_m, torch.sqrt(ql_v)),
-            Normal(local_l_mean, torch.sqrt(local_l_var)),
-        ).sum(dim=1)
+        kl_divergence_z = standard_gaussian_kl(qz_m, qz_v).sum(dim=1)
+        kl_divergence_l = gaussian_kl(ql_m, ql_v, local_l_mean, local_l_var).sum(dim=1)
 
         if is_labelled:
             return reconst_loss, kl_divergence_z + kl_divergence_l, 0.0
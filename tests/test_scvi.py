@@ -1,9 +1,13 @@
+import copy
+import inspect
 import numpy as np
 import pandas as pd
 import tempfile
 import os
 import pytest
 import torch
+from torch.nn import functional as F
+from torch.utils.checkpoint import checkpoint
 
 from anndata import AnnData
 
@@ -29,8 +33,18 @@ from scvi.inference.annotation import compute_accuracy_rf, compute_accuracy_svc
 from scvi.models import VAE, SCANVI, VAEC, LDVAE, TOTALVI, AutoZIVAE
 from scvi.models.distributions import ZeroInflatedNegativeBinomial, NegativeBinomial
 from scvi.models.classifier import Classifier
-from scvi.models.log_likelihood import log_zinb_positive, log_nb_positive
-from scvi import set_seed
+from scvi.models.utils import one_hot
+from scvi.models.log_likelihood import (
+    log_zinb_positive,
+    log_nb_positive,
+    log_mixture_nb,
+    log_gaussian,
+    gaussian_kl,
+    log_standard_gaussian,
+    standard_gaussian_kl,
+    importance_log_ratio,
+)
+from scvi import set_seed, enable_fast_math
 
 set_seed(0)
 use_cuda = True
@@ -301,6 +315,196 @@ def test_poisson_not_zinb():
     trainer_synthetic_svaec.train(n_epochs=1)
 
 
+def test_shared_input_layer():
+    synthetic_dataset = SyntheticDataset()
+    vae = VAE(
+        synthetic_dataset.nb_genes,
+        synthetic_dataset.n_batches,
+        shared_input_layer=True,
+    )
+    trainer_synthetic_vae = UnsupervisedTrainer(
+        vae, synthetic_dataset, train_size=0.5, use_cuda=use_cuda
+    )
+    trainer_synthetic_vae.train(n_epochs=1)
+    trainer_synthetic_vae.train_set.get_latent()
+    trainer_synthetic_vae.train_set.imputation(n_samples=1)
+
+    # the classifier and the adapter go through the shared input layer as well
+    cls = Classifier(vae.n_latent + 1, n_labels=synthetic_dataset.n_labels)
+    trainer_cls = ClassifierTrainer(
+        cls, synthetic_dataset, sampling_model=vae, sampling_zl=True
+    )
+    trainer_cls.train(n_epochs=1)
+    trainer_cls.test_set.accuracy()
+    adapter_trainer = AdapterTrainer(
+        vae, synthetic_dataset, trainer_synthetic_vae.test_set, frequency=1
+    )
+    assert vae.input_encoder in adapter_trainer.adapted_modules
+    adapter_trainer.train(n_path=1, n_epochs=1)
+
+
+def test_sparse_input():
+    synthetic_dataset = SyntheticDataset()
+    vae = VAE(synthetic_dataset.nb_genes, synthetic_dataset.n_batches)
+    x = torch.from_numpy(np.asarray(synthetic_dataset.X[:10], dtype=np.float32))
+    assert vae.encoder_input(x.to_sparse()).is_coalesced()
+    # batch statistics and dropout masks (same seed) also match in train mode
+    for training in [False, True]:
+        vae.train(training)
+        vae.sparse_input = False
+        torch.manual_seed(0)
+        qz_m_dense = vae.z_encoder(vae.encoder_input(x))[0]
+        vae.sparse_input = True
+        torch.manual_seed(0)
+        qz_m_sparse = vae.z_encoder(vae.encoder_input(x))[0]
+        assert torch.allclose(qz_m_dense, qz_m_sparse, atol=1e-5)
+
+    vae = VAE(
+        synthetic_dataset.nb_genes, synthetic_dataset.n_batches, sparse_input=True
+    )
+    trainer_synthetic_vae = UnsupervisedTrainer(
+        vae, synthetic_dataset, train_size=0.5, use_cuda=use_cuda
+    )
+    trainer_synthetic_vae.train(n_epochs=1)
+
+
+@pytest.mark.skipif(
+    not hasattr(torch.nn.Module, "compile"), reason="requires torch>=2.2"
+)
+def test_compile_model():
+    synthetic_dataset = SyntheticDataset()
+    vae = VAE(synthetic_dataset.nb_genes, synthetic_dataset.n_batches)
+    parameter_names = [name for name, _ in vae.named_parameters()]
+    state_keys = list(vae.state_dict().keys())
+    trainer_synthetic_vae = UnsupervisedTrainer(
+        vae, synthetic_dataset, train_size=0.5, use_cuda=use_cuda, compile_model=True
+    )
+    trainer_synthetic_vae.train(n_epochs=1)
+    # compiling in place leaves the parameters and the saved keys untouched
+    assert [name for name, _ in vae.named_parameters()] == parameter_names
+    assert list(vae.state_dict().keys()) == state_keys
+    trainer_synthetic_vae.train_set.get_latent()
+
+
+@pytest.mark.skipif(not hasattr(torch, "autocast"), reason="requires torch>=1.10")
+def test_mixed_precision():
+    synthetic_dataset = SyntheticDataset()
+    vae = VAE(
+        synthetic_dataset.nb_genes,
+        synthetic_dataset.n_batches,
+        dispersion="gene-cell",
+        mixed_precision=True,
+    )
+    trainer_synthetic_vae = UnsupervisedTrainer(
+        vae, synthetic_dataset, train_size=0.5, use_cuda=use_cuda
+    )
+    trainer_synthetic_vae.train(n_epochs=1)
+    device = next(vae.parameters()).device
+    x = torch.from_numpy(np.asarray(synthetic_dataset.X[:10], dtype=np.float32))
+    batch_index = torch.zeros(10, 1, dtype=torch.long)
+    # the first linear layer of the z encoder runs in bfloat16 under autocast
+    dtypes = []
+    first_linear = vae.z_encoder.encoder.fc_layers[0][0]
+    hook = first_linear.register_forward_hook(
+        lambda module, inputs, output: dtypes.append(output.dtype)
+    )
+    outputs = vae.inference(x.to(device), batch_index.to(device))
+    hook.remove()
+    assert dtypes == [torch.bfloat16]
+    assert all(value.dtype == torch.float32 for value in outputs.values())
+
+
+@pytest.mark.skipif(
+    "use_reentrant" not in inspect.signature(checkpoint).parameters,
+    reason="requires torch>=1.11",
+)
+def test_checkpoint():
+    synthetic_dataset = SyntheticDataset()
+    x = torch.from_numpy(np.asarray(synthetic_dataset.X[:10], dtype=np.float32))
+    batch_index = torch.zeros(10, 1, dtype=torch.long)
+    local_l_mean = torch.zeros(10, 1)
+    local_l_var = torch.ones(10, 1)
+    vae = VAE(synthetic_dataset.nb_genes, synthetic_dataset.n_batches)
+    vae_checkpoint = copy.deepcopy(vae)
+    vae_checkpoint.use_checkpoint = True
+    for model in [vae, vae_checkpoint]:
+        torch.manual_seed(0)
+        reconst_loss, kl_local, _ = model(
+            x, local_l_mean, local_l_var, batch_index=batch_index
+        )
+        (reconst_loss + kl_local).sum().backward()
+    for p, p_checkpoint in zip(vae.parameters(), vae_checkpoint.parameters()):
+        if p.grad is not None:
+            assert torch.allclose(p.grad, p_checkpoint.grad, atol=1e-5)
+    # the batch norm statistics are updated once, as without checkpointing
+    state, state_checkpoint = vae.state_dict(), vae_checkpoint.state_dict()
+    for key in state:
+        value, value_checkpoint = state[key].float(), state_checkpoint[key].float()
+        assert torch.allclose(value, value_checkpoint, atol=1e-6), key
+
+
+def test_dispersion_selection():
+    synthetic_dataset = SyntheticDataset()
+    x = torch.from_numpy(np.asarray(synthetic_dataset.X[:10], dtype=np.float32))
+    batch_index = torch.from_numpy(synthetic_dataset.batch_indices[:10].astype(int))
+    labels = torch.from_numpy(synthetic_dataset.labels[:10].astype(int))
+    n_batch, n_labels = synthetic_dataset.n_batches, synthetic_dataset.n_labels
+    for dispersion in ["gene-batch", "gene-label"]:
+        vae = VAE(synthetic_dataset.nb_genes, n_batch, n_labels, dispersion=dispersion)
+        vae.eval()
+        for transform_batch in [None, 1]:
+            for n_samples in [1, 3]:
+                outputs = vae.inference(
+                    x,
+                    batch_index,
+                    labels,
+                    n_samples=n_samples,
+                    transform_batch=transform_batch,
+                )
+                if dispersion == "gene-label":
+                    one_hot_ref = one_hot(labels, n_labels)
+                elif transform_batch is not None:
+                    one_hot_ref = one_hot(
+                        torch.full_like(batch_index, transform_batch), n_batch
+                    )
+                else:
+                    one_hot_ref = one_hot(batch_index, n_batch)
+                px_r_ref = F.linear(one_hot_ref, vae.px_r).exp()
+                assert torch.allclose(outputs["px_r"], px_r_ref, atol=1e-6)
+
+    # the exp is taken before selection above, and on the decoded values per cell
+    vae = VAE(synthetic_dataset.nb_genes, n_batch, dispersion="gene")
+    vae.eval()
+    outputs = vae.inference(x, batch_index)
+    assert torch.allclose(outputs["px_r"], vae.px_r.exp())
+    vae = VAE(synthetic_dataset.nb_genes, n_batch, dispersion="gene-cell")
+    vae.eval()
+    outputs = vae.inference(x, batch_index)
+    px_r_ref = vae.decoder(
+        "gene-cell", outputs["z"], outputs["library"], batch_index
+    )[1].exp()
+    assert torch.allclose(outputs["px_r"], px_r_ref, atol=1e-6)
+
+
+def test_enable_fast_math():
+    cudnn = torch.backends.cudnn
+    flags = (cudnn.deterministic, cudnn.benchmark, cudnn.allow_tf32)
+    has_matmul_precision = hasattr(torch, "get_float32_matmul_precision")
+    if has_matmul_precision:
+        matmul_precision = torch.get_float32_matmul_precision()
+    try:
+        enable_fast_math()
+        assert not cudnn.deterministic
+        assert cudnn.benchmark
+        assert cudnn.allow_tf32
+        if has_matmul_precision:
+            assert torch.get_float32_matmul_precision() == "high"
+    finally:
+        cudnn.deterministic, cudnn.benchmark, cudnn.allow_tf32 = flags
+        if has_matmul_precision:
+            torch.set_float32_matmul_precision(matmul_precision)
+
+
 def test_classifier_accuracy(save_path):
     cortex_dataset = CortexDataset(save_path=save_path)
     cls = Classifier(cortex_dataset.nb_genes, n_labels=cortex_dataset.n_labels)
@@ -581,6 +785,12 @@ def test_zinb_distribution():
     log_p_zinb = dist.log_prob(x)
     assert (log_p_ref - log_p_zinb).abs().max().item() <= 1e-8
 
+    # zero counts mix the dropout mass with the NB mass at zero
+    x_zero = torch.zeros_like(mu)
+    p_zero = torch.sigmoid(pi) + torch.sigmoid(-pi) * (theta / (theta + mu)) ** theta
+    log_p_zero = log_zinb_positive(x_zero, mu, theta, pi)
+    assert (log_p_zero - p_zero.log()).abs().max().item() <= 1e-4
+
     torch.manual_seed(0)
     s1 = dist.sample((100,))
     assert s1.shape == (100, 2)
@@ -607,6 +817,35 @@ def test_zinb_distribution():
     assert dist1.log_prob(x).shape == size
     assert dist2.log_prob(x).shape == size
 
+    # mixture of two negative binomials, with and without a shared dispersion
+    mu_2 = 2.0 * mu
+    theta_2 = 50.0 + torch.rand(size=size)
+    log_p_1 = log_nb_positive(x, mu, theta)
+    log_w_1 = torch.nn.functional.logsigmoid(pi)
+    log_w_2 = torch.nn.functional.logsigmoid(-pi)
+    log_p_mixture = log_mixture_nb(x, mu, mu_2, theta, theta_2, pi)
+    log_p_ref = torch.logsumexp(
+        torch.stack(
+            (
+                log_p_1 + log_w_1,
+                log_nb_positive(x, mu_2, theta_2) + log_w_2,
+            )
+        ),
+        dim=0,
+    )
+    assert (log_p_mixture - log_p_ref).abs().max().item() <= 1e-4
+    log_p_mixture = log_mixture_nb(x, mu, mu_2, theta, None, pi)
+    log_p_ref = torch.logsumexp(
+        torch.stack(
+            (
+                log_p_1 + log_w_1,
+                log_nb_positive(x, mu_2, theta) + log_w_2,
+            )
+        ),
+        dim=0,
+    )
+    assert (log_p_mixture - log_p_ref).abs().max().item() <= 1e-4
+
     with pytest.raises(ValueError):
         ZeroInflatedNegativeBinomial(mu=-mu, theta=theta, zi_logits=pi)
     with pytest.warns(UserWarning):
@@ -615,6 +854,39 @@ def test_zinb_distribution():
         dist2.log_prob(0.5 * x)  # ensures float values raise warning
 
 
+def test_gaussian_closed_forms():
+    m1, m2, x = torch.randn(3, 4, 5)
+    v1 = torch.rand(4, 5) + 0.1
+    v2 = torch.rand(4, 5) + 0.1
+    q = torch.distributions.Normal(m1, v1.sqrt())
+    p = torch.distributions.Normal(m2, v2.sqrt())
+
+    kl_ref = torch.distributions.kl_divergence(q, p)
+    assert (gaussian_kl(m1, v1, m2, v2) - kl_ref).abs().max().item() <= 1e-5
+    assert (log_gaussian(x, m1, v1) - q.log_prob(x)).abs().max().item() <= 1e-5
+
+    zeros, ones = torch.zeros_like(m1), torch.ones_like(v1)
+    kl_std = standard_gaussian_kl(m1, v1) - gaussian_kl(m1, v1, zeros, ones)
+    log_p_std = log_standard_gaussian(x) - log_gaussian(x, zeros, ones)
+    assert kl_std.abs().max().item() <= 1e-5
+    assert log_p_std.abs().max().item() <= 1e-5
+
+    log_px_zl = torch.randn(4)
+    lib, m_pl = torch.randn(2, 4, 1)
+    v_pl = torch.rand(4, 1) + 0.1
+    log_ratio_ref = (
+        log_px_zl
+        + log_standard_gaussian(x).sum(dim=-1)
+        + log_gaussian(lib, m_pl, v_pl).sum(dim=-1)
+        - log_gaussian(x, m1, v1).sum(dim=-1)
+        - log_gaussian(lib, m2[:, :1], v2[:, :1]).sum(dim=-1)
+    )
+    log_ratio = importance_log_ratio(
+        log_px_zl, x, m1, v1, lib, m2[:, :1], v2[:, :1], m_pl, v_pl
+    )
+    assert (log_ratio - log_ratio_ref).abs().max().item() <= 1e-4
+
+
 def test_anndata_loader():
     x = np.random.randint(low=0, high=100, size=(15, 4))
     batch_ids = np.random.randint(low=0, high=2, size=(15,))